@@ -5,10 +5,20 @@ import enum
 import json
 import sys
 from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
 from dataclasses import dataclass, field
-from functools import cached_property
+from io import StringIO
 from types import NoneType
-from typing import Literal, Self, TextIO, assert_never, cast
+from typing import Any, BinaryIO, Literal, Self, cast
+
+import orjson
+
+# Size of the blocks read from the input stream, lines are split out of each block
+CHUNK_SIZE = 8 * 1024 * 1024
+# Strings with at least this many distinct values are typed as `str` instead of a Literal
+MAX_LITERAL_VALUES = 10
+# orjson parses integers outside of [-2**63, 2**64) as floats, all at least this big
+INEXACT_INT_MIN = float(2**63)
 
 
 class TypeEnum(enum.Enum):
@@ -25,81 +35,97 @@ class TypeEnum(enum.Enum):
     NEVER = "never"
 
     @classmethod
-    def from_type(cls, t: type) -> Self:
-        map = {
-            str: cls.STRING,
-            int: cls.INT,
-            float: cls.FLOAT,
-            bool: cls.BOOL,
-            NoneType: cls.NONE,
-        }
-        if t not in map:
+    def from_type(cls, t: type) -> TypeEnum:
+        if t not in _TYPE_MAP:
             raise TypeError(f"Cannot convert {t=} to {cls=}")
-        return map[t]
-
-
-@dataclass(kw_only=True)
+        return _TYPE_MAP[t]
+
+
+LiteralTypeEnum = Literal[
+    TypeEnum.STRING, TypeEnum.INT, TypeEnum.FLOAT, TypeEnum.BOOL, TypeEnum.NONE
+]
+
+# Lookup tables for scalar values, built once instead of on every leaf
+_TYPE_MAP: dict[type, LiteralTypeEnum] = {
+    str: TypeEnum.STRING,
+    int: TypeEnum.INT,
+    float: TypeEnum.FLOAT,
+    bool: TypeEnum.BOOL,
+    NoneType: TypeEnum.NONE,
+}
+_AS_TYPE_STR: dict[TypeEnum, str] = {
+    TypeEnum.STRING: "str",
+    TypeEnum.INT: "int",
+    TypeEnum.FLOAT: "float",
+    TypeEnum.BOOL: "bool",
+    TypeEnum.NONE: "None",
+}
+
+
+@dataclass
+class Output:
+    buffer: StringIO = field(default_factory=StringIO)
+    # Class name emitted for each object shape, keyed by its property lines
+    classes: dict[frozenset[str], str] = field(default_factory=dict)
+
+
+@dataclass(kw_only=True, slots=True)
 class TypeDef:
     name: str = field(repr=False)
     type: TypeEnum
 
-    def as_type_str(self) -> str:
-        print(repr(self))
-        raise NotImplementedError()
+    def as_type_str(self, output: Output) -> str:
+        raise NotImplementedError(f"Cannot build a type string for {self!r}")
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class LiteralTypeDef(TypeDef):
-    type: Literal[
-        TypeEnum.STRING, TypeEnum.INT, TypeEnum.FLOAT, TypeEnum.BOOL, TypeEnum.NONE
-    ]
+    type: LiteralTypeEnum
 
     @classmethod
     def from_type(cls, t: type, name: str) -> Self:
-        # Constructing a dict with a list of tuples allows pytight to infer a narrower type
-        # for the dict keys and values
-        type_map = dict(
-            (
-                (str, TypeEnum.STRING),
-                (int, TypeEnum.INT),
-                (float, TypeEnum.FLOAT),
-                (bool, TypeEnum.BOOL),
-                (NoneType, TypeEnum.NONE),
-            )
-        )
-        return cls(name=name, type=type_map[t])
+        return cls(name=name, type=_TYPE_MAP[t])
 
-    def as_type_str(self) -> str:
-        map = {
-            TypeEnum.STRING: "str",
-            TypeEnum.INT: "int",
-            TypeEnum.FLOAT: "float",
-            TypeEnum.BOOL: "bool",
-            TypeEnum.NONE: "None",
-        }
-        return map[self.type]
+    def as_type_str(self, output: Output) -> str:
+        return _AS_TYPE_STR[self.type]
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class MaybeStringEnumDef(LiteralTypeDef):
     type: Literal[TypeEnum.STRING] = field(
         init=False, default=TypeEnum.STRING, repr=False
     )
     values: Counter[str]
+    # Set once there are too many distinct values for a Literal, values stop being
+    # counted from then on since the type can only ever be rendered as `str`
+    capped: bool = field(default=False, repr=False, init=False)
 
     def merge(self, other: MaybeStringEnumDef) -> Self:
-        self.values.update(other.values)
+        if self.capped:
+            return self
+        if other.capped:
+            self.capped = True
+            return self
+        if len(other.values) == 1:
+            # Most merges add a single parsed string, adding it directly skips the
+            # generic Mapping handling of Counter.update which is a lot slower
+            for value, count in other.values.items():
+                self.values[value] += count
+        else:
+            self.values.update(other.values)
+        if len(self.values) >= MAX_LITERAL_VALUES:
+            self.capped = True
         return self
 
-    def as_type_str(self) -> str:
+    def as_type_str(self, output: Output) -> str:
         # Treat as a Literal if:
         # - There are less than 10 distinct values
-        if len(self.values) < 10:
+        if not self.capped and len(self.values) < MAX_LITERAL_VALUES:
             return f"t.Literal[{', '.join(map(repr, self.values.keys()))}]"
         return "str"
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class ObjectDef(TypeDef):
     properties: dict[str, TypeDef]
     type: Literal[TypeEnum.OBJECT] = field(
@@ -112,51 +138,57 @@ class ObjectDef(TypeDef):
     merge_count: int = field(default=0, repr=False, init=False)
 
     def __post_init__(self) -> None:
-        self.keys_statistic.update(self.keys)
+        self.keys_statistic.update(self.properties.keys())
 
     def merge(self, other: ObjectDef) -> Self:
-        self.keys_statistic.update(other.keys)
+        self.keys_statistic.update(other.properties.keys())
         self.merge_count += 1
+        self.not_required_keys.update(other.not_required_keys)
+        self.not_required_keys.update(self.properties.keys() - other.properties.keys())
         for other_key, other_value in other.properties.items():
             if other_key in self.properties:
-                self.properties[other_key] = merge_types(
+                self.properties[other_key] = _merge_same_name(
                     other_value, self.properties[other_key]
                 )
             else:
                 self.not_required_keys.add(other_key)
                 self.properties[other_key] = other_value
-        for key in self.keys:
-            if key not in other.keys:
-                self.not_required_keys.add(key)
         return self
 
-    @cached_property
-    def keys(self) -> set[str]:
-        return set(self.properties.keys())
+    @staticmethod
+    def _build_class_name(path: str) -> str:
+        name = path.removeprefix("$").replace("/", "_").strip("_").replace("*", "")
+        if name == "":
+            name = "Root"
+        else:
+            name = "".join(map(str.capitalize, name.split("_")))
+        return f"{name}Dict"
 
-    def as_type_str(self) -> str:
+    def as_type_str(self, output: Output) -> str:
         if not self.properties:
             return "dict[str, t.Any]"
 
         lines = list[str]()
-        name = self.name.removeprefix("$").replace("/", "_").strip("_").replace("*", "")
-        if name == "":
-            name = "Root"
-        else:
-            name = "".join(map(str.capitalize, name.split("_")))
-        name = f"{name}Dict"
-        lines.append(f"class {name}(t.TypedDict):")
         for key, value in self.properties.items():
             if key in self.not_required_keys:
-                lines.append(f"    {key}: t.NotRequired[{value.as_type_str()}]")
+                lines.append(f"    {key}: t.NotRequired[{value.as_type_str(output)}]")
             else:
-                lines.append(f"    {key}: {value.as_type_str()}")
-        print("\n".join(lines))
-        print()
+                lines.append(f"    {key}: {value.as_type_str(output)}")
+
+        # Objects with the same shape share the class emitted for the first of them
+        shape = frozenset(lines)
+        if shape in output.classes:
+            return output.classes[shape]
+
+        name = self._build_class_name(self.name)
+        output.classes[shape] = name
+        output.buffer.write(f"class {name}(t.TypedDict):\n")
+        output.buffer.write("\n".join(lines))
+        output.buffer.write("\n\n")
         return name
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class ArrayDef(TypeDef):
     items: TypeDef
     type: Literal[TypeEnum.ARRAY] = field(
@@ -166,159 +198,276 @@ class ArrayDef(TypeDef):
     def __hash__(self) -> int:
         return hash((self.name, self.type, self.items))
 
-    def as_type_str(self) -> str:
-        return f"list[{self.items.as_type_str()}]"
+    def as_type_str(self, output: Output) -> str:
+        return f"list[{self.items.as_type_str(output)}]"
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class OneOfDef(TypeDef):
     items: list[ArrayDef | LiteralTypeDef | ObjectDef]
     type: TypeEnum = field(init=False, default=TypeEnum.ONE_OF, repr=False)
 
     @property
     def needs_union(self) -> bool:
-        types = [item.type for item in self.items]
-        return TypeEnum.NONE in types and len(types) == 2
+        return len(self.items) == 2 and any(
+            item.type is TypeEnum.NONE for item in self.items
+        )
 
-    def as_type_str(self) -> str:
-        items = list[TypeDef]()
-        for item in self.items:
-            if isinstance(item, LiteralTypeDef) and item.type == TypeEnum.NONE:
-                continue
-            items.append(item)
+    def as_type_str(self, output: Output) -> str:
+        items = [item for item in self.items if item.type is not TypeEnum.NONE]
 
         if len(items) == 1:
-            return f"t.Optional[{items[0].as_type_str()}]"
+            return f"t.Optional[{items[0].as_type_str(output)}]"
         else:
-            return f"Union[{', '.join([item.as_type_str() for item in items])}]"
+            return f"Union[{', '.join([item.as_type_str(output) for item in items])}]"
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class NeverDef(TypeDef):
     name: str = "__never__"
     type: Literal[TypeEnum.NEVER] = TypeEnum.NEVER
 
-    def as_type_str(self) -> str:
+    def as_type_str(self, output: Output) -> str:
         return "t.Never"
 
 
+def _merge_never_left(a: NeverDef, b: TypeDef) -> TypeDef:
+    return b
+
+
+def _merge_never_right(a: TypeDef, b: NeverDef) -> TypeDef:
+    return a
+
+
+def _merge_literals(a: LiteralTypeDef, b: LiteralTypeDef) -> TypeDef:
+    if a.type == b.type:
+        # Plain literals are never mutated, so they can be shared
+        return a
+    elif {a.type, b.type} == {TypeEnum.INT, TypeEnum.FLOAT}:
+        return LiteralTypeDef(name=a.name, type=TypeEnum.FLOAT)
+    else:
+        return OneOfDef(items=[a, b], name=a.name)
+
+
+def _merge_strings(a: LiteralTypeDef, b: LiteralTypeDef) -> TypeDef:
+    if isinstance(a, MaybeStringEnumDef) and isinstance(b, MaybeStringEnumDef):
+        return a.merge(b)
+    return LiteralTypeDef(name=a.name, type=TypeEnum.STRING)
+
+
+def _merge_one_of_left(
+    a: OneOfDef, b: ArrayDef | LiteralTypeDef | ObjectDef
+) -> TypeDef:
+    return _merge_into_buckets(a, (b,))
+
+
+def _merge_one_of_right(
+    a: ArrayDef | LiteralTypeDef | ObjectDef, b: OneOfDef
+) -> TypeDef:
+    return _merge_into_buckets(b, (a,))
+
+
+def _merge_one_of_one_of(a: OneOfDef, b: OneOfDef) -> TypeDef:
+    return _merge_into_buckets(a, b.items)
+
+
+def _merge_into_buckets(
+    one_of: OneOfDef, others: Iterable[ArrayDef | LiteralTypeDef | ObjectDef]
+) -> OneOfDef:
+    """Merge each of `others` into the member of `one_of` of the same kind"""
+    # Members of a union are unique by kind, so they can be bucketed by it up front
+    # and each merge is a lookup instead of a scan of the members
+    buckets = {(item.__class__, item.type): item for item in one_of.items}
+    for other in others:
+        bucket = buckets.get((other.__class__, other.type))
+        if bucket is None:
+            buckets[(other.__class__, other.type)] = other
+        elif isinstance(bucket, MaybeStringEnumDef):
+            bucket.merge(cast(MaybeStringEnumDef, other))
+        elif isinstance(bucket, ObjectDef):
+            bucket.merge(cast(ObjectDef, other))
+        elif isinstance(bucket, ArrayDef):
+            bucket.items = _merge_same_name(bucket.items, cast(ArrayDef, other).items)
+    return OneOfDef(items=list(buckets.values()), name=one_of.name)
+
+
+def _merge_object_literal(
+    a: ObjectDef | LiteralTypeDef, b: ObjectDef | LiteralTypeDef
+) -> TypeDef:
+    return OneOfDef(items=[a, b], name=a.name)
+
+
+def _merge_arrays(a: ArrayDef, b: ArrayDef) -> TypeDef:
+    return ArrayDef(
+        name=a.name,
+        items=_merge_same_name(a.items, b.items),
+    )
+
+
+def _merge_objects(a: ObjectDef, b: ObjectDef) -> TypeDef:
+    return a.merge(b)
+
+
+_LITERAL_TYPES = (
+    TypeEnum.STRING,
+    TypeEnum.INT,
+    TypeEnum.FLOAT,
+    TypeEnum.BOOL,
+    TypeEnum.NONE,
+)
+
+# Merge handler for each pair of types, pairs missing from the table can't be merged.
+# Each handler is annotated with the classes its rows guarantee, and a Callable over
+# TypeDef would reject them since parameter types are contravariant, hence the Any
+_MERGE: dict[tuple[TypeEnum, TypeEnum], Callable[[Any, Any], TypeDef]] = {
+    **{(a, b): _merge_literals for a in _LITERAL_TYPES for b in _LITERAL_TYPES},
+    (TypeEnum.STRING, TypeEnum.STRING): _merge_strings,
+    **{(TypeEnum.OBJECT, t): _merge_object_literal for t in _LITERAL_TYPES},
+    **{(t, TypeEnum.OBJECT): _merge_object_literal for t in _LITERAL_TYPES},
+    (TypeEnum.OBJECT, TypeEnum.OBJECT): _merge_objects,
+    (TypeEnum.ARRAY, TypeEnum.ARRAY): _merge_arrays,
+    **{(TypeEnum.ONE_OF, t): _merge_one_of_left for t in TypeEnum},
+    **{(t, TypeEnum.ONE_OF): _merge_one_of_right for t in TypeEnum},
+    (TypeEnum.ONE_OF, TypeEnum.ONE_OF): _merge_one_of_one_of,
+    **{(TypeEnum.NEVER, t): _merge_never_left for t in TypeEnum},
+    **{(t, TypeEnum.NEVER): _merge_never_right for t in TypeEnum},
+}
+
+
 def merge_types(a: TypeDef, b: TypeDef) -> TypeDef:
     if a.name != b.name and not isinstance(a, NeverDef) and not isinstance(b, NeverDef):
         raise TypeError(f"Cannot merge {a.name=} and {b.name=}")
+    return _merge_same_name(a, b)
+
+
+def _merge_same_name(a: TypeDef, b: TypeDef) -> TypeDef:
+    """merge_types for values known to share a name, like the items of one list"""
+    if a is b:
+        return a
+
+    merge = _MERGE.get((a.type, b.type))
+    if merge is None:
+        raise SystemExit(f'Cannot merge "{a.type}" and "{b.type}"')
+    return merge(a, b)
+
+
+def _fold_merge(children: list[TypeDef]) -> TypeDef:
+    """Merge the items of a list, in order, into a single TypeDef"""
+    result: TypeDef = NeverDef()
+    remaining = iter(children)
+    for child in remaining:
+        result = _merge_same_name(result, child)
+        if isinstance(result, OneOfDef):
+            break
+    else:
+        return result
+
+    # Once a union is formed each remaining child merges into the member of its kind
+    # or becomes a new member
+    return _merge_into_buckets(
+        result, cast(Iterator[ArrayDef | LiteralTypeDef | ObjectDef], remaining)
+    )
 
-    match (a, b):
-        case [NeverDef(), value] | [value, NeverDef()]:
-            return value
-        case [MaybeStringEnumDef(), MaybeStringEnumDef()]:
-            return a.merge(b)
-        case [LiteralTypeDef(), LiteralTypeDef()]:
-            if a.type == b.type:
-                return LiteralTypeDef(
-                    name=a.name,
-                    type=a.type,
-                )
-            elif {a.type, b.type} == {TypeEnum.INT, TypeEnum.FLOAT}:
-                return LiteralTypeDef(name=a.name, type=TypeEnum.FLOAT)
-            else:
-                return OneOfDef(items=[a, b], name=a.name)
-        case (
-            [OneOfDef() as one_of, other]
-            | [
-                other,
-                OneOfDef() as one_of,
-            ]
-        ) if not isinstance(other, OneOfDef):
-            if isinstance(other, MaybeStringEnumDef):
-                for item in one_of.items:
-                    if isinstance(item, MaybeStringEnumDef):
-                        item.merge(other)
-                        return one_of
-            elif isinstance(other, LiteralTypeDef):
-                for item in one_of.items:
-                    if item == other:
-                        return one_of
-            elif isinstance(other, ObjectDef):
-                for item in one_of.items:
-                    if isinstance(item, ObjectDef):
-                        item.merge(other)
-                        return one_of
-            elif isinstance(other, ArrayDef):
-                for item in one_of.items:
-                    if isinstance(item, ArrayDef):
-                        item.items = merge_types(item.items, other.items)
-                        return one_of
-            elif isinstance(
-                other, TypeDef
-            ):  # pyright: ignore [reportUnnecessaryIsInstance]
-                raise NotImplementedError()
-            else:
-                assert_never(other)
 
-            return OneOfDef(items=[*one_of.items, other], name=one_of.name)
-        case [ObjectDef(), LiteralTypeDef()] | [LiteralTypeDef(), ObjectDef()]:
-            return OneOfDef(items=[a, b], name=a.name)
-        case [ArrayDef(), ArrayDef()]:
-            return ArrayDef(
-                name=a.name,
-                items=merge_types(a.items, b.items),
-            )
-        case [ObjectDef(), ObjectDef()]:
-            return a.merge(b)
-        case [OneOfDef(), OneOfDef()]:
-            result = a
-            for item in b.items:
-                result = merge_types(result, item)
-            return result
-        case _:
-            raise SystemExit(f'Cannot merge "{a.type}" and "{b.type}"')
+class InexactIntError(Exception):
+    """A parsed float may be an integer that didn't fit in 64 bits"""
 
 
-def process_obj(obj: object, name: str = "$") -> TypeDef:
+def process_obj(obj: object, name: str = "$", check_ints: bool = False) -> TypeDef:
+    """Build the TypeDef of a parsed JSON value
+
+    With `check_ints`, floats at least as big as `INEXACT_INT_MIN` raise an
+    `InexactIntError`, since they may be integers orjson parsed as floats.
+    """
     match obj:
         case str():
-            return MaybeStringEnumDef(name=name, values=Counter([obj]))
-        case int() | float() | bool() | None:
+            # Cheaper than Counter([obj]), which allocates a list and runs the counting loop
+            values = Counter[str]()
+            values[obj] = 1
+            return MaybeStringEnumDef(name=name, values=values)
+        case float():
+            if check_ints and abs(obj) >= INEXACT_INT_MIN:
+                raise InexactIntError(obj)
+            return LiteralTypeDef(name=name, type=TypeEnum.FLOAT)
+        case int() | bool() | None:
             return LiteralTypeDef.from_type(type(obj), name)
         case dict():
             return ObjectDef(
                 name=name,
                 properties={
-                    key: process_obj(value, f"{name}/{key}")
+                    key: process_obj(value, f"{name}/{key}", check_ints)
                     for key, value in cast(dict[str, object], obj).items()
                 },
             )
         case list():
-            items = NeverDef()
-            for value in cast(list[object], obj):
-                items = merge_types(items, process_obj(value, f"{name}/*"))
+            children = [
+                process_obj(value, f"{name}/*", check_ints)
+                for value in cast(list[object], obj)
+            ]
             return ArrayDef(
                 name=name,
-                items=items,
+                items=_fold_merge(children),
             )
         case _:
             raise NotImplementedError()
 
 
-def json_line_generator(input: TextIO):
-    for line in input:
+def line_generator(input: BinaryIO) -> Iterator[bytes]:
+    # Parts of a line spanning several chunks, joined once its end is found
+    parts = list[bytes]()
+    while chunk := input.read(CHUNK_SIZE):
+        *lines, last = chunk.split(b"\n")
+        if lines:
+            parts.append(lines[0])
+            lines[0] = b"".join(parts)
+            yield from lines
+            parts.clear()
+        parts.append(last)
+    if tail := b"".join(parts):
+        yield tail
+
+
+def parse_line(line: bytes) -> object:
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        # json also accepts NaN, Infinity and floats overflowing a double
+        return json.loads(line)
+
+
+def type_lines(lines: Iterable[bytes]) -> Iterator[TypeDef]:
+    for line in lines:
+        if not line.strip():
+            continue
         try:
-            yield json.loads(line)
+            obj = parse_line(line)
         except json.JSONDecodeError:
-            print(f"Invalid JSON: {line}", file=sys.stderr)
+            print(f"Invalid JSON: {line.decode(errors='replace')}", file=sys.stderr)
+            continue
+        try:
+            line_type = process_obj(obj, check_ints=True)
+        except InexactIntError:
+            # Rare enough that parsing the line again with json, which keeps big
+            # integers as ints, is cheaper than looking for them up front
+            line_type = process_obj(json.loads(line))
+        yield line_type
 
 
 def build_type_def(obj: TypeDef) -> str:
-    return obj.as_type_str()
+    output = Output()
+    output.buffer.write("import typing as t\n\n")
+    # Nested class definitions are written to the output while the root type is built
+    root = obj.as_type_str(output)
+    output.buffer.write(f"RootType = {root}")
+    return output.buffer.getvalue()
 
 
 def main() -> int:
-    final_type = NeverDef()
-    for i, line in enumerate(json_line_generator(sys.stdin)):
+    final_type: TypeDef = NeverDef()
+    for i, line_type in enumerate(type_lines(line_generator(sys.stdin.buffer))):
         print("Processing line:", i, file=sys.stderr, end="\r")
-        final_type = merge_types(final_type, process_obj(line))
-    print("import typing as t")
-    print()
-    print(f"RootType = {build_type_def(final_type)}", end="")
+        final_type = merge_types(final_type, line_type)
+    sys.stdout.write(build_type_def(final_type))
     return 0
 
 
@@ -1,7 +1,24 @@
 from contextlib import redirect_stdout
-from io import StringIO
+from functools import reduce
+from io import BytesIO, StringIO
 import sys
-from json2type import main
+
+import pytest
+
+import json2type
+from json2type import (
+    MAX_LITERAL_VALUES,
+    ArrayDef,
+    MaybeStringEnumDef,
+    NeverDef,
+    ObjectDef,
+    build_type_def,
+    line_generator,
+    main,
+    merge_types,
+    process_obj,
+    type_lines,
+)
 
 
 def test_basic_type_generation():
@@ -13,3 +30,65 @@ def test_basic_type_generation():
         with open("tests/test_data/test_1.py") as f:
             expected = f.read()
         assert generated.getvalue() == expected
+
+
+def test_line_generator_chunk_boundaries(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(json2type, "CHUNK_SIZE", 4)
+    data = BytesIO(b'{"a": 1}\n\n[1, 2]\n"abc"')
+    assert list(line_generator(data)) == [b'{"a": 1}', b"", b"[1, 2]", b'"abc"']
+
+
+def test_object_merge_collects_keys():
+    a = process_obj({"a": 1})
+    a = merge_types(a, process_obj({"b": 1}))
+    a = merge_types(a, process_obj({"a": 1, "b": 1}))
+    assert isinstance(a, ObjectDef)
+    assert a.properties.keys() == {"a", "b"}
+    assert a.not_required_keys == {"a", "b"}
+
+
+def test_object_merge_keeps_not_required_keys_of_both_sides():
+    a = merge_types(process_obj({"a": 1}), process_obj({"a": 1, "b": 1}))
+    b = merge_types(process_obj({"a": 1, "b": 1}), process_obj({"b": 1}))
+    merged = merge_types(a, b)
+    assert isinstance(merged, ObjectDef)
+    assert merged.not_required_keys == {"a", "b"}
+
+
+def test_identical_objects_share_a_class():
+    generated = build_type_def(process_obj({"a": {"x": 1}, "b": {"x": 2}}))
+    assert generated.count("class ADict(t.TypedDict):") == 1
+    assert "BDict" not in generated
+    assert "    a: ADict\n    b: ADict\n" in generated
+
+
+def test_string_values_stop_being_counted_past_literal_limit():
+    merged = process_obj([str(i) for i in range(20)])
+    assert isinstance(merged, ArrayDef)
+    assert isinstance(merged.items, MaybeStringEnumDef)
+    assert merged.items.capped
+    assert len(merged.items.values) == MAX_LITERAL_VALUES
+    assert build_type_def(merged).endswith("RootType = list[str]")
+
+
+def test_line_generator_long_line_across_chunks(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(json2type, "CHUNK_SIZE", 4)
+    data = BytesIO(b"a" * 10 + b"\nbc\n" + b"d" * 9)
+    assert list(line_generator(data)) == [b"a" * 10, b"bc", b"d" * 9]
+
+
+def test_type_lines_keeps_numbers_orjson_cannot_parse_exactly():
+    lines = [
+        b'{"big": 123456789012345678901234567890, "low": -9223372036854775809}',
+        b'{"u64": 18446744073709551615, "float": 1e20, "small": 2.5}',
+        b'{"nan": NaN, "inf": -1e400}',
+        b"not json",
+    ]
+    generated = build_type_def(reduce(merge_types, type_lines(lines), NeverDef()))
+    assert "    big: t.NotRequired[int]\n" in generated
+    assert "    low: t.NotRequired[int]\n" in generated
+    assert "    u64: t.NotRequired[int]\n" in generated
+    assert "    float: t.NotRequired[float]\n" in generated
+    assert "    small: t.NotRequired[float]\n" in generated
+    assert "    nan: t.NotRequired[float]\n" in generated
+    assert "    inf: t.NotRequired[float]\n" in generated